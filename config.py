@@ -25,6 +25,8 @@ class GraphRAGConfig:
     # 模型配置
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")
     llm_model: str = os.getenv("LLM_MODEL", "moonshot-v1-8k")
+    llm_model_small: str = os.getenv("LLM_MODEL_SMALL", "")  # 简单查询使用的轻量模型，为空则不分级
+    small_model_complexity_threshold: float = 0.4  # 查询复杂度低于该值时使用轻量模型
 
     # 检索配置（LightRAG Round-robin策略）
     top_k: int = 5
@@ -38,6 +40,9 @@ class GraphRAGConfig:
     chunk_overlap: int = 50
     max_graph_depth: int = 2  # 图遍历最大深度
 
+    # 会话缓存配置
+    session_cache_dir: str = os.getenv("SESSION_CACHE_DIR", "")  # 会话语义缓存持久化目录，为空则仅保存在内存
+
     def __post_init__(self):
         """初始化后的处理"""
         # LightRAG使用Round-robin策略，无需权重验证
@@ -61,13 +66,16 @@ class GraphRAGConfig:
             'milvus_dimension': self.milvus_dimension,
             'embedding_model': self.embedding_model,
             'llm_model': self.llm_model,
+            'llm_model_small': self.llm_model_small,
+            'small_model_complexity_threshold': self.small_model_complexity_threshold,
             'top_k': self.top_k,
 
             'temperature': self.temperature,
             'max_tokens': self.max_tokens,
             'chunk_size': self.chunk_size,
             'chunk_overlap': self.chunk_overlap,
-            'max_graph_depth': self.max_graph_depth
+            'max_graph_depth': self.max_graph_depth,
+            'session_cache_dir': self.session_cache_dir
         }
 
 # 默认配置实例
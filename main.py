@@ -7,6 +7,7 @@ import os
 import sys
 import time
 import logging
+import concurrent.futures
 from datetime import datetime
 from typing import List, Optional
 
@@ -66,38 +67,43 @@ class AdvancedGraphRAGSystem:
 
         # 会话缓存管理器
         self.cache_manager = None
+
+        # 查询向量化函数（初始化时解析一次）
+        self._embed_fn = None
         
     def initialize_system(self):
         """初始化高级图RAG系统"""
         logger.info("启动高级图RAG系统...")
         
         try:
-            # 1. 数据准备模块
-            print("初始化数据准备模块...")
-            self.data_module = GraphDataPreparationModule(
-                uri=self.config.neo4j_uri,
-                user=self.config.neo4j_user,
-                password=self.config.neo4j_password,
-                database=self.config.neo4j_database
-            )
-            
-            # 2. 向量索引模块
-            print("初始化Milvus向量索引...")
-            self.index_module = MilvusIndexConstructionModule(
-                host=self.config.milvus_host,
-                port=self.config.milvus_port,
-                collection_name=self.config.milvus_collection_name,
-                dimension=self.config.milvus_dimension,
-                model_name=self.config.embedding_model
-            )
-            
-            # 3. 生成模块
-            print("初始化生成模块...")
-            self.generation_module = GenerationIntegrationModule(
-                model_name=self.config.llm_model,
-                temperature=self.config.temperature,
-                max_tokens=self.config.max_tokens
-            )
+            # 🚀 1-3. 数据准备、向量索引、生成模块互不依赖，并行建立连接/加载模型
+            print("并行初始化数据准备模块、Milvus向量索引、生成模块...")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                future_data = executor.submit(
+                    GraphDataPreparationModule,
+                    uri=self.config.neo4j_uri,
+                    user=self.config.neo4j_user,
+                    password=self.config.neo4j_password,
+                    database=self.config.neo4j_database
+                )
+                future_index = executor.submit(self._create_index_module)
+                future_generation = executor.submit(
+                    GenerationIntegrationModule,
+                    model_name=self.config.llm_model,
+                    temperature=self.config.temperature,
+                    max_tokens=self.config.max_tokens,
+                    small_model_name=self.config.llm_model_small,
+                    small_model_complexity_threshold=self.config.small_model_complexity_threshold
+                )
+
+                # 后续模块依赖这三个模块，任一失败都会在此抛出
+                self.data_module = future_data.result()
+                self.index_module = future_index.result()
+                self.generation_module = future_generation.result()
+
+            # 一次性解析向量化函数，避免每次查询时重复探测属性
+            self._embed_fn = getattr(self.index_module, 'embedding_model', None)
+            self._embed_fn = self._embed_fn.embed_documents if self._embed_fn else None
             
             # 4. 传统混合检索模块
             print("初始化传统混合检索...")
@@ -127,7 +133,8 @@ class AdvancedGraphRAGSystem:
             # 7. 会话缓存管理器
             print("初始化会话缓存管理器...")
             self.cache_manager = SessionCacheManager(
-                embedding_model=self.index_module.embeddings
+                embedding_model=self.index_module.embeddings,
+                persist_dir=self.config.session_cache_dir
             )
 
             # 8. 菜谱推荐管理器
@@ -144,6 +151,19 @@ class AdvancedGraphRAGSystem:
             logger.error(f"系统初始化失败: {e}")
             raise
     
+    def _create_index_module(self) -> MilvusIndexConstructionModule:
+        """创建向量索引模块，并在并行初始化阶段预热共享的嵌入模型"""
+        index_module = MilvusIndexConstructionModule(
+            host=self.config.milvus_host,
+            port=self.config.milvus_port,
+            collection_name=self.config.milvus_collection_name,
+            dimension=self.config.milvus_dimension,
+            model_name=self.config.embedding_model
+        )
+        # 嵌入模型按需加载；服务启动后必然用到，这里提前加载以与其他模块的初始化重叠
+        _ = index_module.embeddings
+        return index_module
+    
     def build_knowledge_base(self):
         """构建知识库（如果需要）"""
         print("\n检查知识库状态...")
@@ -255,11 +275,6 @@ class AdvancedGraphRAGSystem:
             
         print(f"\n❓ 用户问题: {question}")
         
-        # 显示路由决策解释（可选）
-        if explain_routing:
-            explanation = self.query_router.explain_routing_decision(question)
-            print(explanation)
-        
         start_time = time.time()
         
         try:
@@ -267,6 +282,10 @@ class AdvancedGraphRAGSystem:
             print("执行智能查询路由...")
             relevant_docs, analysis = self.query_router.route_query(question, self.config.top_k)
             
+            # 显示路由决策解释（可选），复用本次路由的分析结果
+            if explain_routing:
+                print(self.query_router.explain_routing_decision(question, analysis))
+            
             # 2. 显示路由信息
             strategy_icons = {
                 "hybrid_traditional": "🔍",
@@ -294,10 +313,11 @@ class AdvancedGraphRAGSystem:
             
             # 4. 生成回答
             print("🎯 智能生成回答...")
+            model_name = self.generation_module.select_model(analysis.query_complexity)
             
             if stream:
                 try:
-                    for chunk_text in self.generation_module.generate_adaptive_answer_stream(question, relevant_docs):
+                    for chunk_text in self.generation_module.generate_adaptive_answer_stream(question, relevant_docs, model_name=model_name):
                         print(chunk_text, end="", flush=True)
                     print("\n")
                     result = "流式输出完成"
@@ -305,9 +325,9 @@ class AdvancedGraphRAGSystem:
                     logger.error(f"流式输出过程中出现错误: {stream_error}")
                     print(f"\n⚠️ 流式输出中断，切换到标准模式...")
                     # 使用非流式作为后备
-                    result = self.generation_module.generate_adaptive_answer(question, relevant_docs)
+                    result = self.generation_module.generate_adaptive_answer(question, relevant_docs, model_name=model_name)
             else:
-                result = self.generation_module.generate_adaptive_answer(question, relevant_docs)
+                result = self.generation_module.generate_adaptive_answer(question, relevant_docs, model_name=model_name)
             
             # 5. 性能统计
             end_time = time.time()
@@ -321,14 +341,7 @@ class AdvancedGraphRAGSystem:
 
     def _get_query_embedding(self, query: str):
         """获取查询的向量表示（用于语义缓存）"""
-        try:
-            if hasattr(self.index_module, 'embedding_model'):
-                # 使用现有的embedding模型
-                return self.index_module.embedding_model.embed_documents([query])[0]
-            return None
-        except Exception as e:
-            logger.warning(f"获取查询向量失败: {e}")
-            return None
+        return self._embed_fn([query])[0] if self._embed_fn else None
 
     def run_web_service(self):
         """运行Web服务模式"""
@@ -352,8 +365,8 @@ class AdvancedGraphRAGSystem:
             print(f"📈 统计信息: http://localhost:8000/api/stats")
             print("=" * 50)
 
-            # 启动Flask应用
-            app.run(host='0.0.0.0', port=8000, debug=False)
+            # 启动Flask应用（多线程：每个请求独立线程，流式聊天互不阻塞）
+            app.run(host='0.0.0.0', port=8000, debug=False, threaded=True)
 
         except Exception as e:
             logger.error(f"Web服务启动失败: {e}")
@@ -5,7 +5,7 @@
 import logging
 import os
 import time
-from typing import List
+from typing import List, Optional
 
 from openai import OpenAI
 from langchain_core.documents import Document
@@ -15,11 +15,15 @@ logger = logging.getLogger(__name__)
 class GenerationIntegrationModule:
     """生成集成模块 - 负责答案生成"""
 
-    def __init__(self, model_name: str = "kimi-k2-0711-preview", temperature: float = 0.1, max_tokens: int = 2048):
+    def __init__(self, model_name: str = "kimi-k2-0711-preview", temperature: float = 0.1, max_tokens: int = 2048,
+                 small_model_name: Optional[str] = None, small_model_complexity_threshold: float = 0.4):
         """
         初始化生成集成模块
         """
         self.model_name = model_name
+        # 分级路由：简单查询交给轻量模型，复杂推理仍使用主模型
+        self.small_model_name = small_model_name or None
+        self.small_model_complexity_threshold = small_model_complexity_threshold
         self.temperature = temperature
         self.max_tokens = max_tokens
         
@@ -35,7 +39,14 @@ class GenerationIntegrationModule:
             base_url=self.base_url
         )
 
-        logger.info(f"生成模块初始化完成，模型: {model_name}, API地址: {self.base_url}")
+        logger.info(f"生成模块初始化完成，模型: {model_name}, 轻量模型: {self.small_model_name}, API地址: {self.base_url}")
+
+    def select_model(self, query_complexity: Optional[float] = None) -> str:
+        """根据查询复杂度选择生成模型（复用路由器的复杂度分析结果）"""
+        if (self.small_model_name and query_complexity is not None
+                and query_complexity < self.small_model_complexity_threshold):
+            return self.small_model_name
+        return self.model_name
 
     def _build_prompt(self, question: str, context: str) -> str:
         """构建统一的提示词"""
@@ -57,7 +68,7 @@ class GenerationIntegrationModule:
         回答：
         """
 
-    def generate_adaptive_answer(self, question: str, documents: List[Document]) -> str:
+    def generate_adaptive_answer(self, question: str, documents: List[Document], model_name: Optional[str] = None) -> str:
         """
         智能统一答案生成
         自动适应不同类型的查询，无需预先分类
@@ -82,7 +93,7 @@ class GenerationIntegrationModule:
         
         try:
             response = self.client.chat.completions.create(
-                model=self.model_name,
+                model=model_name or self.model_name,
                 messages=[
                     {"role": "user", "content": prompt}
                 ],
@@ -96,7 +107,8 @@ class GenerationIntegrationModule:
             logger.error(f"LightRAG答案生成失败: {e}")
             return f"抱歉，生成回答时出现错误：{str(e)}"
     
-    def generate_adaptive_answer_stream(self, question: str, documents: List[Document], max_retries: int = 3):
+    def generate_adaptive_answer_stream(self, question: str, documents: List[Document], max_retries: int = 3,
+                                        model_name: Optional[str] = None):
         """
         LightRAG风格的流式答案生成（带重试机制）
         """
@@ -120,7 +132,7 @@ class GenerationIntegrationModule:
         for attempt in range(max_retries):
             try:
                 response = self.client.chat.completions.create(
-                    model=self.model_name,
+                    model=model_name or self.model_name,
                     messages=[
                         {"role": "user", "content": prompt}
                     ],
@@ -159,7 +171,7 @@ class GenerationIntegrationModule:
                     print("⚠️ 流式生成失败，切换到标准模式...")
                     
                     try:
-                        fallback_response = self.generate_adaptive_answer(question, documents)
+                        fallback_response = self.generate_adaptive_answer(question, documents, model_name=model_name)
                         yield fallback_response
                         return
                     except Exception as fallback_error:
@@ -10,7 +10,6 @@ from typing import List, Dict, Tuple, Any
 from dataclasses import dataclass
 
 from langchain_core.documents import Document
-from langchain_community.retrievers import BM25Retriever
 from neo4j import GraphDatabase
 from .graph_indexing import GraphIndexingModule
 
@@ -43,7 +42,8 @@ class HybridRetrievalModule:
         self.data_module = data_module
         self.llm_client = llm_client
         self.driver = None
-        self.bm25_retriever = None
+        self._bm25_retriever = None
+        self._bm25_chunks = []
         
         # 图索引模块
         self.graph_indexing = GraphIndexingModule(config, llm_client)
@@ -59,13 +59,22 @@ class HybridRetrievalModule:
             auth=(self.config.neo4j_user, self.config.neo4j_password)
         )
         
-        # 初始化BM25检索器
-        if chunks:
-            self.bm25_retriever = BM25Retriever.from_documents(chunks)
-            logger.info(f"BM25检索器初始化完成，文档数量: {len(chunks)}")
+        # BM25检索器不在检索主路径上，首次使用时再构建，避免拖慢启动
+        self._bm25_chunks = chunks or []
+        self._bm25_retriever = None
         
         # 初始化图索引
         self._build_graph_index()
+    
+    @property
+    def bm25_retriever(self):
+        """BM25检索器（首次访问时构建）"""
+        if self._bm25_retriever is None and self._bm25_chunks:
+            from langchain_community.retrievers import BM25Retriever
+            
+            self._bm25_retriever = BM25Retriever.from_documents(self._bm25_chunks)
+            logger.info(f"BM25检索器初始化完成，文档数量: {len(self._bm25_chunks)}")
+        return self._bm25_retriever
         
     def _build_graph_index(self):
         """构建图索引"""
@@ -7,6 +7,8 @@
 
 import json
 import logging
+import time
+import concurrent.futures
 from typing import List, Dict, Tuple, Any, Optional
 from dataclasses import dataclass
 from enum import Enum
@@ -52,6 +54,8 @@ class IntelligentQueryRouter:
         self.graph_rag_retrieval = graph_rag_retrieval
         self.llm_client = llm_client
         self.config = config
+
+        self.combined_search_timeout = 30  # 组合检索等待两路结果的总超时（秒）
         
         # 路由统计
         self.route_stats = {
@@ -207,42 +211,27 @@ class IntelligentQueryRouter:
         """
         组合搜索策略：并行执行传统检索和图RAG检索
         """
-        import concurrent.futures
-        import threading
-
         # 分配结果数量
         traditional_k = max(1, top_k // 2)
         graph_k = top_k - traditional_k
 
-        # 🚀 并行执行两种检索
-        traditional_docs = []
-        graph_docs = []
-
-        def traditional_search():
-            nonlocal traditional_docs
-            try:
-                traditional_docs = self.traditional_retrieval.hybrid_search(query, traditional_k)
-                logger.info(f"传统检索完成: {len(traditional_docs)} 个结果")
-            except Exception as e:
-                logger.error(f"传统检索失败: {e}")
-                traditional_docs = []
-
-        def graph_search():
-            nonlocal graph_docs
-            try:
-                graph_docs = self.graph_rag_retrieval.graph_rag_search(query, graph_k)
-                logger.info(f"图RAG检索完成: {len(graph_docs)} 个结果")
-            except Exception as e:
-                logger.error(f"图RAG检索失败: {e}")
-                graph_docs = []
-
-        # 使用线程池并行执行
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            future_traditional = executor.submit(traditional_search)
-            future_graph = executor.submit(graph_search)
+        # 🚀 并行执行两种检索，总耗时取两者中较慢的一路
+        # 每次查询独立的线程池：两路检索都会调用LLM，全局共享的线程池在并发请求下会排队
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            future_traditional = executor.submit(
+                self.traditional_retrieval.hybrid_search, query, traditional_k
+            )
+            future_graph = executor.submit(
+                self.graph_rag_retrieval.graph_rag_search, query, graph_k
+            )
 
-            # 等待两个检索完成
-            concurrent.futures.wait([future_traditional, future_graph], timeout=30)
+            deadline = time.monotonic() + self.combined_search_timeout
+            traditional_docs = self._collect_search_result(future_traditional, "传统检索", deadline)
+            graph_docs = self._collect_search_result(future_graph, "图RAG检索", deadline)
+        finally:
+            # 不等待超时的检索结束，超时真正生效
+            executor.shutdown(wait=False)
 
         # 合并和去重
         combined_docs = []
@@ -271,6 +260,19 @@ class IntelligentQueryRouter:
         
         return combined_docs[:top_k]
     
+    def _collect_search_result(self, future: concurrent.futures.Future, name: str, deadline: float) -> List[Document]:
+        """在截止时间内获取一路检索结果，超时或失败时返回空列表"""
+        try:
+            docs = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            logger.info(f"{name}完成: {len(docs)} 个结果")
+            return docs
+        except concurrent.futures.TimeoutError:
+            logger.error(f"{name}超时")
+            return []
+        except Exception as e:
+            logger.error(f"{name}失败: {e}")
+            return []
+    
     def _post_process_results(self, documents: List[Document], analysis: QueryAnalysis) -> List[Document]:
         """
         结果后处理：根据查询分析优化结果
@@ -309,9 +311,10 @@ class IntelligentQueryRouter:
             "combined_ratio": self.route_stats["combined_count"] / total
         }
     
-    def explain_routing_decision(self, query: str) -> str:
-        """解释路由决策过程"""
-        analysis = self.analyze_query(query)
+    def explain_routing_decision(self, query: str, analysis: Optional[QueryAnalysis] = None) -> str:
+        """解释路由决策过程（传入route_query返回的分析结果可避免重复分析）"""
+        if analysis is None:
+            analysis = self.analyze_query(query)
         
         explanation = f"""
         查询路由分析报告
@@ -4,6 +4,8 @@ Milvus索引构建模块
 
 import logging
 import time
+import threading
+import concurrent.futures
 from typing import List, Dict, Any, Optional
 
 from pymilvus import MilvusClient, DataType, CollectionSchema, FieldSchema
@@ -43,11 +45,16 @@ class MilvusIndexConstructionModule:
         self.model_name = model_name
         
         self.client = None
-        self.embeddings = None
+        self._embeddings = None
+        self._embeddings_lock = threading.Lock()
         self.collection_created = False
+        self.insert_batch_size = 128  # 构建索引时每批向量化并插入的文档块数
+        self.insert_max_workers = 4  # 构建索引时同时在途的插入请求数（向量化始终在单线程中进行）
+        self.flush_debounce_seconds = 30  # 增量插入后延迟flush的时间，期间的插入合并为一次flush
+        self._flush_timer = None
+        self._flush_lock = threading.Lock()
         
         self._setup_client()
-        self._setup_embeddings()
     
     def _safe_truncate(self, text: str, max_length: int) -> str:
         """
@@ -64,6 +71,34 @@ class MilvusIndexConstructionModule:
             return ""
         return str(text)[:max_length]
     
+    def _chunk_to_entity(self, chunk: Document, vector: List[float], default_id: str) -> Dict[str, Any]:
+        """
+        将文档块和向量转换为Milvus插入行
+        
+        Args:
+            chunk: 文档块
+            vector: 文档块的向量
+            default_id: 文档块缺少chunk_id时使用的默认ID
+            
+        Returns:
+            符合集合模式的实体字典
+        """
+        chunk_id = self._safe_truncate(chunk.metadata.get("chunk_id", default_id), 150)
+        return {
+            "id": chunk_id,
+            "vector": vector,
+            "text": self._safe_truncate(chunk.page_content, 15000),
+            "node_id": self._safe_truncate(chunk.metadata.get("node_id", ""), 100),
+            "recipe_name": self._safe_truncate(chunk.metadata.get("recipe_name", ""), 300),
+            "node_type": self._safe_truncate(chunk.metadata.get("node_type", ""), 100),
+            "category": self._safe_truncate(chunk.metadata.get("category", ""), 100),
+            "cuisine_type": self._safe_truncate(chunk.metadata.get("cuisine_type", ""), 200),
+            "difficulty": int(chunk.metadata.get("difficulty", 0)),
+            "doc_type": self._safe_truncate(chunk.metadata.get("doc_type", ""), 50),
+            "chunk_id": chunk_id,
+            "parent_id": self._safe_truncate(chunk.metadata.get("parent_id", ""), 100)
+        }
+    
     def _setup_client(self):
         """初始化Milvus客户端"""
         try:
@@ -80,11 +115,25 @@ class MilvusIndexConstructionModule:
             logger.error(f"连接Milvus失败: {e}")
             raise
     
+    @property
+    def embeddings(self) -> HuggingFaceEmbeddings:
+        """嵌入模型（首次访问时加载，所有使用方共享同一实例）"""
+        if self._embeddings is None:
+            with self._embeddings_lock:
+                if self._embeddings is None:
+                    self._setup_embeddings()
+        return self._embeddings
+    
+    @property
+    def embedding_model(self) -> HuggingFaceEmbeddings:
+        """embeddings的别名，保证按任一名称访问都得到同一个模型实例"""
+        return self.embeddings
+    
     def _setup_embeddings(self):
         """初始化嵌入模型"""
         logger.info(f"正在初始化嵌入模型: {self.model_name}")
         
-        self.embeddings = HuggingFaceEmbeddings(
+        self._embeddings = HuggingFaceEmbeddings(
             model_name=self.model_name,
             model_kwargs={'device': 'cpu'},
             encode_kwargs={'normalize_embeddings': True}
@@ -200,6 +249,69 @@ class MilvusIndexConstructionModule:
             logger.error(f"创建索引失败: {e}")
             return False
     
+    def _wait_for_index_ready(self, timeout: float = 60.0, interval: float = 0.5) -> bool:
+        """
+        轮询向量索引构建进度，直到所有行都已建好索引
+        
+        Args:
+            timeout: 最长等待时间（秒）
+            interval: 轮询间隔（秒）
+            
+        Returns:
+            是否在超时前完成
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                index_info = self.client.describe_index(
+                    collection_name=self.collection_name,
+                    index_name="vector"
+                )
+                pending_rows = index_info.get("pending_index_rows", 0)
+                if index_info.get("state") == "Finished" or (
+                    pending_rows == 0 and index_info.get("indexed_rows", 0) >= index_info.get("total_rows", 0)
+                ):
+                    logger.info(f"索引构建完成: {index_info.get('indexed_rows', 0)} 行")
+                    return True
+                logger.info(f"索引构建中，剩余 {pending_rows} 行...")
+            except Exception as e:
+                logger.warning(f"查询索引构建进度失败: {e}")
+                return False
+            time.sleep(interval)
+        
+        logger.warning(f"等待索引构建超时（{timeout}秒），继续运行")
+        return False
+    
+    def _embed_batch(self, batch: List[Document], offset: int) -> List[Dict[str, Any]]:
+        """
+        向量化一批文档块并转换为Milvus实体
+        
+        Args:
+            batch: 文档块批次
+            offset: 批次在全部文档块中的起始位置（用于生成默认ID）
+            
+        Returns:
+            待插入的实体列表
+        """
+        vectors = self.embeddings.embed_documents([chunk.page_content for chunk in batch])
+        return [
+            self._chunk_to_entity(chunk, vector, f"chunk_{offset + j}")
+            for j, (chunk, vector) in enumerate(zip(batch, vectors))
+        ]
+    
+    def _insert_entities(self, entities: List[Dict[str, Any]]) -> int:
+        """
+        插入一批实体到Milvus
+        
+        Returns:
+            插入的条数
+        """
+        self.client.insert(
+            collection_name=self.collection_name,
+            data=entities
+        )
+        return len(entities)
+    
     def build_vector_index(self, chunks: List[Document]) -> bool:
         """
         构建向量索引
@@ -220,52 +332,40 @@ class MilvusIndexConstructionModule:
             if not self.create_collection(force_recreate=True):
                 return False
             
-            # 2. 准备数据
-            logger.info("正在生成向量embeddings...")
-            texts = [chunk.page_content for chunk in chunks]
-            vectors = self.embeddings.embed_documents(texts)
+            # 2. 分批生成向量并插入：向量化在当前线程顺序进行（CPU模型单次调用已占满所有核心，
+            #    且共享的tokenizer不支持并发调用），只让Milvus插入的网络往返与下一批的向量化重叠
+            logger.info("正在分批生成向量embeddings并插入...")
+            batch_size = self.insert_batch_size
+            max_workers = self.insert_max_workers
+            in_flight = threading.Semaphore(max_workers)  # 限制同时在途的插入批次数，控制内存占用
+            futures = []
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for i in range(0, len(chunks), batch_size):
+                    entities = self._embed_batch(chunks[i:i + batch_size], i)
+                    in_flight.acquire()
+                    future = executor.submit(self._insert_entities, entities)
+                    future.add_done_callback(lambda _: in_flight.release())
+                    futures.append(future)
+                
+                inserted = 0
+                for future in concurrent.futures.as_completed(futures):
+                    inserted += future.result()
+                    logger.info(f"已插入 {inserted}/{len(chunks)} 条数据")
             
-            # 3. 准备插入数据
-            entities = []
-            for i, (chunk, vector) in enumerate(zip(chunks, vectors)):
-                entity = {
-                    "id": self._safe_truncate(chunk.metadata.get("chunk_id", f"chunk_{i}"), 150),
-                    "vector": vector,
-                    "text": self._safe_truncate(chunk.page_content, 15000),
-                    "node_id": self._safe_truncate(chunk.metadata.get("node_id", ""), 100),
-                    "recipe_name": self._safe_truncate(chunk.metadata.get("recipe_name", ""), 300),
-                    "node_type": self._safe_truncate(chunk.metadata.get("node_type", ""), 100),
-                    "category": self._safe_truncate(chunk.metadata.get("category", ""), 100),
-                    "cuisine_type": self._safe_truncate(chunk.metadata.get("cuisine_type", ""), 200),
-                    "difficulty": int(chunk.metadata.get("difficulty", 0)),
-                    "doc_type": self._safe_truncate(chunk.metadata.get("doc_type", ""), 50),
-                    "chunk_id": self._safe_truncate(chunk.metadata.get("chunk_id", f"chunk_{i}"), 150),
-                    "parent_id": self._safe_truncate(chunk.metadata.get("parent_id", ""), 100)
-                }
-                entities.append(entity)
-            
-            # 4. 批量插入数据
-            logger.info("正在插入向量数据...")
-            batch_size = 100
-            for i in range(0, len(entities), batch_size):
-                batch = entities[i:i + batch_size]
-                self.client.insert(
-                    collection_name=self.collection_name,
-                    data=batch
-                )
-                logger.info(f"已插入 {min(i + batch_size, len(entities))}/{len(entities)} 条数据")
+            # 所有批次完成后只flush一次
+            self.client.flush(collection_name=self.collection_name)
             
-            # 5. 创建索引
+            # 3. 创建索引
             if not self.create_index():
                 return False
             
-            # 6. 加载集合到内存
+            # 4. 加载集合到内存
             self.client.load_collection(self.collection_name)
             logger.info("集合已加载到内存")
             
-            # 7. 等待索引构建完成
+            # 5. 等待索引构建完成
             logger.info("等待索引构建完成...")
-            time.sleep(2)
+            self._wait_for_index_ready()
             
             logger.info(f"向量索引构建完成，包含 {len(chunks)} 个向量")
             return True
@@ -295,23 +395,11 @@ class MilvusIndexConstructionModule:
             vectors = self.embeddings.embed_documents(texts)
             
             # 准备插入数据
-            entities = []
-            for i, (chunk, vector) in enumerate(zip(new_chunks, vectors)):
-                entity = {
-                    "id": self._safe_truncate(chunk.metadata.get("chunk_id", f"new_chunk_{i}_{int(time.time())}"), 150),
-                    "vector": vector,
-                    "text": self._safe_truncate(chunk.page_content, 15000),
-                    "node_id": self._safe_truncate(chunk.metadata.get("node_id", ""), 100),
-                    "recipe_name": self._safe_truncate(chunk.metadata.get("recipe_name", ""), 300),
-                    "node_type": self._safe_truncate(chunk.metadata.get("node_type", ""), 100),
-                    "category": self._safe_truncate(chunk.metadata.get("category", ""), 100),
-                    "cuisine_type": self._safe_truncate(chunk.metadata.get("cuisine_type", ""), 200),
-                    "difficulty": int(chunk.metadata.get("difficulty", 0)),
-                    "doc_type": self._safe_truncate(chunk.metadata.get("doc_type", ""), 50),
-                    "chunk_id": self._safe_truncate(chunk.metadata.get("chunk_id", f"new_chunk_{i}_{int(time.time())}"), 150),
-                    "parent_id": self._safe_truncate(chunk.metadata.get("parent_id", ""), 100)
-                }
-                entities.append(entity)
+            suffix = int(time.time())
+            entities = [
+                self._chunk_to_entity(chunk, vector, f"new_chunk_{i}_{suffix}")
+                for i, (chunk, vector) in enumerate(zip(new_chunks, vectors))
+            ]
             
             # 插入数据
             self.client.insert(
@@ -319,6 +407,9 @@ class MilvusIndexConstructionModule:
                 data=entities
             )
             
+            # 频繁的小批量插入不逐次flush，合并到防抖定时器中统一flush
+            self._schedule_flush()
+            
             logger.info("新文档添加完成")
             return True
             
@@ -326,6 +417,27 @@ class MilvusIndexConstructionModule:
             logger.error(f"添加新文档失败: {e}")
             return False
     
+    def _schedule_flush(self):
+        """（重新）启动防抖flush定时器"""
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self.flush_debounce_seconds, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def _flush(self):
+        """执行一次flush，将增量插入的数据封存为segment"""
+        with self._flush_lock:
+            # 只清除自身的引用：执行期间可能已有新定时器被启动，需保留给close()处理
+            if self._flush_timer is threading.current_thread():
+                self._flush_timer = None
+        try:
+            self.client.flush(collection_name=self.collection_name)
+            logger.info("增量数据flush完成")
+        except Exception as e:
+            logger.error(f"增量数据flush失败: {e}")
+    
     def similarity_search(self, query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         相似度搜索
@@ -498,6 +610,17 @@ class MilvusIndexConstructionModule:
     
     def close(self):
         """关闭连接"""
+        # 有待执行的防抖flush时立即执行，避免丢失
+        flush_lock = getattr(self, '_flush_lock', None)
+        if flush_lock is not None:
+            with flush_lock:
+                pending = self._flush_timer
+                if pending is not None:
+                    pending.cancel()
+                    self._flush_timer = None
+            if pending is not None:
+                self._flush()
+        
         if hasattr(self, 'client') and self.client:
             # Milvus客户端不需要显式关闭
             logger.info("Milvus连接已关闭")
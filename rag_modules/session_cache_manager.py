@@ -3,10 +3,20 @@
 负责管理会话级语义缓存和上下文
 """
 
+import hashlib
 import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
 import numpy as np
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple
+
+try:
+    import faiss  # 可选：使用FAISS的SIMD内积内核做最近邻检索
+except ImportError:
+    faiss = None
 
 logger = logging.getLogger(__name__)
 
@@ -18,100 +28,525 @@ class SessionCacheManager:
     1. 会话级语义缓存 - 每个聊天窗口独立缓存
     2. 上下文管理 - 维护对话历史
     3. 语义相似度匹配 - 智能缓存命中
+    4. 缓存持久化 - 可选，重启后按需从磁盘恢复会话缓存
     """
     
-    def __init__(self, embedding_model=None):
-        """初始化缓存管理器"""
+    def __init__(self, embedding_model=None, persist_dir: Optional[str] = None):
+        """
+        初始化缓存管理器
+
+        Args:
+            embedding_model: 嵌入模型
+            persist_dir: 会话缓存持久化目录，为空则只保存在内存中
+        """
         self.embedding_model = embedding_model
         
         # 🚀 会话级语义缓存系统 - 针对每个聊天窗口独立缓存
-        self.session_caches = {}  # 按session_id分组的缓存：{session_id: {query: response}}
-        self.session_embeddings = {}  # 按session_id分组的向量：{session_id: {query: embedding}}
+        self.session_caches = {}  # 按session_id分组的环形缓冲区：{session_id: {'matrix', 'keys', 'responses', 'timestamps', 'head', 'size'}}
         self.session_contexts = {}  # 按session_id分组的上下文：{session_id: [messages]}
+        self.session_context_turns = {}  # 最近几轮已格式化的对话：{session_id: deque([formatted_turn])}
+        self.session_context_prompts = {}  # 最近几轮对话拼接好的上下文：{session_id: str}
         
         # 缓存配置
         self.cache_threshold = 0.75  # 语义相似度阈值
         self.max_session_cache_size = 50  # 每个会话最大缓存条目数
         self.max_context_length = 10  # 每个会话保留的最大上下文消息数
+        self.max_prompt_context_turns = 3  # 构建增强查询时使用的最近对话轮数
+
+        # 会话缓存的恢复/创建需串行，避免并发请求重复创建并截断同一个mmap文件
+        self._session_lock = threading.RLock()
+
+        # 查询向量LRU缓存：同一请求内的缓存检查/写入只计算一次embedding
+        self._embedding_cache = OrderedDict()  # {query: normalized_embedding}
+        self._embedding_cache_lock = threading.Lock()
+        self.max_embedding_cache_size = 2048
+
+        # 会话缓存持久化：向量矩阵以.npy文件mmap，查询/答案存入SQLite
+        self.persist_dir = persist_dir or None
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._persisted_sessions = set()
+        if self.persist_dir:
+            self._setup_persistence()
     
-    def _calculate_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
-        """计算两个向量的余弦相似度"""
+    def _setup_persistence(self):
+        """初始化持久化存储，只枚举已持久化的会话，向量矩阵在首次访问时再mmap"""
         try:
-            dot_product = np.dot(embedding1, embedding2)
-            norm1 = np.linalg.norm(embedding1)
-            norm2 = np.linalg.norm(embedding2)
-            return dot_product / (norm1 * norm2)
-        except:
-            return 0.0
+            os.makedirs(self.persist_dir, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(self.persist_dir, "session_cache.db"),
+                check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # WAL下NORMAL只在checkpoint时fsync，单次commit不再等待磁盘同步
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, head INTEGER NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "session_id TEXT NOT NULL, slot INTEGER NOT NULL, query TEXT NOT NULL, "
+                "response TEXT NOT NULL, timestamp INTEGER NOT NULL, PRIMARY KEY (session_id, slot))"
+            )
+            self._db.commit()
+
+            self._persisted_sessions = {
+                row[0] for row in self._db.execute("SELECT session_id FROM sessions")
+                if os.path.exists(self._session_matrix_path(row[0]))
+            }
+            logger.info(f"会话缓存持久化已启用: {self.persist_dir}, 可恢复会话数: {len(self._persisted_sessions)}")
+        except Exception as e:
+            logger.warning(f"会话缓存持久化初始化失败，仅使用内存缓存: {e}")
+            self.persist_dir = None
+            self._db = None
 
-    def check_semantic_cache(self, query: str, session_id: str = None) -> Optional[str]:
-        """检查会话级语义缓存中是否有相似查询"""
-        if not session_id or session_id not in self.session_caches:
+    def _session_matrix_path(self, session_id: str) -> str:
+        """会话向量矩阵文件路径（session_id取哈希，避免非法文件名）"""
+        file_name = hashlib.sha1(session_id.encode("utf-8")).hexdigest() + ".npy"
+        return os.path.join(self.persist_dir, file_name)
+
+    def _load_persisted_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """从磁盘恢复会话缓存：矩阵mmap按需换页，不做整体读取"""
+        try:
+            with self._db_lock:
+                meta = self._db.execute(
+                    "SELECT head, size FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                rows = self._db.execute(
+                    "SELECT slot, query, response, timestamp FROM entries WHERE session_id = ?", (session_id,)
+                ).fetchall()
+            if meta is None:
+                return None
+
+            matrix = np.load(self._session_matrix_path(session_id), mmap_mode='r+')
+            capacity = self.max_session_cache_size
+            if matrix.shape[0] != capacity:
+                logger.warning(f"会话 {session_id} 的持久化缓存容量不一致，已忽略")
+                return None
+
+            session_cache = {
+                'matrix': matrix,
+                'keys': [None] * capacity,
+                'responses': [None] * capacity,
+                'timestamps': [None] * capacity,
+                'exact': {},
+                'head': meta[0],
+                'size': meta[1]
+            }
+            for slot, query, response, timestamp in rows:
+                session_cache['keys'][slot] = query
+                session_cache['responses'][slot] = response
+                session_cache['timestamps'][slot] = timestamp
+                session_cache['exact'][self._normalize_query(query)] = slot
+
+            logger.info(f"📂 已从磁盘恢复会话缓存 {session_id}, 大小: {session_cache['size']}")
+            return session_cache
+
+        except Exception as e:
+            logger.warning(f"恢复会话缓存失败: {e}")
             return None
 
-        session_cache = self.session_caches[session_id]
-        session_embeddings = self.session_embeddings[session_id]
+    def _slot_record(self, session_id: str, session_cache: Dict[str, Any], slot: int) -> Optional[Tuple]:
+        """在_session_lock内复制一个槽位待持久化的数据，未启用持久化时返回None"""
+        if self._db is None:
+            return None
+        return (session_id, slot, session_cache['keys'][slot], session_cache['responses'][slot],
+                session_cache['timestamps'][slot], session_cache['head'], session_cache['size'])
+
+    def _persist_slot(self, record: Optional[Tuple]):
+        """
+        持久化一个槽位的查询/答案及环形缓冲区位置（向量已直接写入mmap）
+
+        在_session_lock外调用，避免磁盘写入阻塞其他会话的缓存查询；
+        并发写入可能乱序提交，按时间戳只保留较新的槽位数据
+        """
+        if record is None or self._db is None:
+            return
+        session_id, slot, query, response, timestamp, head, size = record
+        try:
+            with self._db_lock:
+                cursor = self._db.execute(
+                    "INSERT INTO entries (session_id, slot, query, response, timestamp) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(session_id, slot) DO UPDATE SET "
+                    "query = excluded.query, response = excluded.response, timestamp = excluded.timestamp "
+                    "WHERE excluded.timestamp >= entries.timestamp",
+                    (session_id, slot, query, response, timestamp)
+                )
+                # 过期的写入同样不更新环形缓冲区位置
+                if cursor.rowcount:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sessions (session_id, head, size) VALUES (?, ?, ?)",
+                        (session_id, head, size)
+                    )
+                self._db.commit()
+        except Exception as e:
+            logger.warning(f"持久化会话缓存失败: {e}")
+
+    def _delete_persisted_session(self, session_id: str):
+        """删除会话的持久化数据"""
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute("DELETE FROM entries WHERE session_id = ?", (session_id,))
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._db.commit()
+            self._persisted_sessions.discard(session_id)
+            path = self._session_matrix_path(session_id)
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            logger.warning(f"删除持久化会话缓存失败: {e}")
+
+    def _get_session_cache(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """获取会话缓存，内存中没有时尝试从磁盘恢复"""
+        session_cache = self.session_caches.get(session_id)
+        if session_cache is not None or session_id not in self._persisted_sessions:
+            return session_cache
+
+        with self._session_lock:
+            # 加锁后再检查一次：其他线程可能已完成恢复
+            session_cache = self.session_caches.get(session_id)
+            if session_cache is None and session_id in self._persisted_sessions:
+                session_cache = self._load_persisted_session(session_id)
+                if session_cache is not None:
+                    self.session_caches[session_id] = session_cache
+                self._persisted_sessions.discard(session_id)
+        return session_cache
+
+    def has_semantic_cache(self, session_id: str) -> bool:
+        """会话是否已有可匹配的缓存条目"""
+        if not session_id:
+            return False
+        session_cache = self._get_session_cache(session_id)
+        return bool(session_cache and session_cache['size'])
+    
+    def _embed(self, query: str) -> np.ndarray:
+        """获取归一化的查询向量，优先复用已计算的结果"""
+        with self._embedding_cache_lock:
+            cached = self._embedding_cache.get(query)
+            if cached is not None:
+                self._embedding_cache.move_to_end(query)
+                return cached
+
+        query_embedding = self.embedding_model.embed_documents([query])[0]
+        return self._store_embedding(query, query_embedding)
+
+    def _embed_batch(self, queries: List[str]) -> List[np.ndarray]:
+        """批量获取归一化的查询向量，未缓存的查询合并为一次embed_documents调用"""
+        vectors = {}
+        with self._embedding_cache_lock:
+            for query in queries:
+                cached = self._embedding_cache.get(query)
+                if cached is not None:
+                    self._embedding_cache.move_to_end(query)
+                    vectors[query] = cached
+
+        missing = list(dict.fromkeys(query for query in queries if query not in vectors))
+        if missing:
+            for query, embedding in zip(missing, self.embedding_model.embed_documents(missing)):
+                vectors[query] = self._store_embedding(query, embedding)
+
+        return [vectors[query] for query in queries]
+
+    def _store_embedding(self, query: str, query_embedding) -> np.ndarray:
+        """归一化查询向量并写入LRU缓存"""
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        # 只在写入时归一化一次，之后的相似度计算都是纯内积；eps防止零向量除零
+        query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-12)
+        query_vec.setflags(write=False)
+
+        with self._embedding_cache_lock:
+            self._embedding_cache[query] = query_vec
+            if len(self._embedding_cache) > self.max_embedding_cache_size:
+                self._embedding_cache.popitem(last=False)
+
+        return query_vec
+
+    def _new_session_cache(self, session_id: str, dimension: int) -> Dict[str, Any]:
+        """创建定长环形缓冲区：向量矩阵(float16) + 并行的查询/答案/时间戳列表"""
+        capacity = self.max_session_cache_size
+        if self.persist_dir:
+            # 持久化时矩阵直接是磁盘文件的mmap，写入即落盘（由页缓存回写）
+            matrix = np.lib.format.open_memmap(
+                self._session_matrix_path(session_id), mode='w+',
+                dtype=np.float16, shape=(capacity, dimension)
+            )
+        else:
+            matrix = np.zeros((capacity, dimension), dtype=np.float16)
+        return {
+            'matrix': matrix,
+            'keys': [None] * capacity,
+            'responses': [None] * capacity,
+            'timestamps': [None] * capacity,  # time.time_ns()整数时间戳，仅用于排序/调试
+            'exact': {},  # 规范化查询 -> 槽位，精确匹配时跳过embedding
+            'head': 0,  # 下一个写入位置
+            'size': 0   # 已占用的槽位数
+        }
+
+    def _check_dimension(self, session_id: str, session_cache: Dict[str, Any], dimension: int) -> bool:
+        """
+        校验会话缓存的向量维度与当前嵌入模型一致
+
+        更换嵌入模型后，磁盘恢复的旧缓存维度不同，无法参与内积计算，直接丢弃
+        """
+        cached_dimension = session_cache['matrix'].shape[1]
+        if cached_dimension == dimension:
+            return True
 
-        if not session_cache:
+        logger.warning(f"会话 {session_id} 的缓存向量维度({cached_dimension})与当前模型({dimension})不一致，已丢弃")
+        if self.session_caches.get(session_id) is session_cache:
+            del self.session_caches[session_id]
+        self._delete_persisted_session(session_id)
+        return False
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """精确匹配使用的规范化查询"""
+        return query.strip().lower()
+
+    def _best_matches(self, matrix: np.ndarray, query_vecs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在归一化的缓存矩阵(N, D)中为每个查询向量(M, D)查找内积最大的行
+
+        Returns:
+            (best_indices, best_similarities)，形状均为(M,)
+        """
+        # 缓存以float16存储；NumPy没有float16的BLAS内核，计算时升到float32
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        query_vecs = np.ascontiguousarray(query_vecs, dtype=np.float32)
+
+        if faiss is not None:
+            # 🚀 FAISS暴力内积检索（AVX2/AVX-512/NEON内核），直接作用于环形缓冲区，无需维护索引
+            scores, indices = faiss.knn(query_vecs.copy(), matrix, 1, metric=faiss.METRIC_INNER_PRODUCT)
+            return indices[:, 0], scores[:, 0]
+
+        # 🚀 一次矩阵乘法计算所有查询与所有缓存查询的相似度（缓存向量已在插入时归一化）
+        # M=1时退化为单次矩阵-向量乘法
+        similarities = query_vecs @ matrix.T
+        best_indices = np.argmax(similarities, axis=1)
+        return best_indices, similarities[np.arange(len(query_vecs)), best_indices]
+
+    def check_exact_cache(self, query: str, session_id: str = None) -> Optional[str]:
+        """精确匹配会话缓存：重复提问直接命中，无需计算embedding"""
+        if not self.has_semantic_cache(session_id):
             return None
+        return self._lookup_exact(query, session_id)
+
+    def _lookup_exact(self, query: str, session_id: str) -> Optional[str]:
+        """精确匹配查找，调用方已确认会话存在缓存"""
+        exact_key = self._normalize_query(query)
+        with self._session_lock:
+            session_cache = self.session_caches.get(session_id)
+            slot = session_cache['exact'].get(exact_key) if session_cache else None
+            if slot is None:
+                return None
+            response = session_cache['responses'][slot]
+
+        logger.info(f"🎯 会话缓存精确命中! Session: {session_id}")
+        return response
+
+    def _snapshot_session(self, session_id: str, dimension: int) -> Optional[Tuple[np.ndarray, List[str]]]:
+        """
+        在锁内复制会话缓存的向量矩阵(float32)与查询列表，相似度计算在锁外基于副本进行
+
+        Returns:
+            (matrix, keys)，会话不存在、为空或维度不一致时返回None
+        """
+        with self._session_lock:
+            session_cache = self.session_caches.get(session_id)
+            if not session_cache or not session_cache['size']:
+                return None
+            if not self._check_dimension(session_id, session_cache, dimension):
+                return None
+            size = session_cache['size']
+            # 容量仅50行，复制开销很小；直接升为float32，_best_matches无需再次转换
+            return np.array(session_cache['matrix'][:size], dtype=np.float32), session_cache['keys'][:size]
+
+    def _read_matched_response(self, session_id: str, slot: int, matched_query: str) -> Optional[str]:
+        """读取匹配槽位的答案；槽位在计算相似度期间已被覆盖时返回None"""
+        with self._session_lock:
+            session_cache = self.session_caches.get(session_id)
+            if not session_cache or session_cache['keys'][slot] != matched_query:
+                return None
+            return session_cache['responses'][slot]
+
+    def check_semantic_cache(self, query: str, session_id: str = None) -> Optional[str]:
+        """检查会话级语义缓存中是否有相似查询"""
+        if not self.has_semantic_cache(session_id):
+            return None
+
+        # 🚀 精确匹配：重复提问直接命中，无需计算embedding
+        cached_response = self._lookup_exact(query, session_id)
+        if cached_response is not None:
+            return cached_response
 
         try:
             # 计算查询向量
-            query_embedding = self.embedding_model.embed_documents([query])[0]
+            query_vec = self._embed(query)
         except Exception as e:
             logger.warning(f"查询向量计算失败: {e}")
             return None
 
-        # 查找最相似的缓存查询
-        best_similarity = 0
-        best_response = None
-
-        for cached_query, cached_data in session_cache.items():
-            cached_embedding = session_embeddings.get(cached_query)
-            if cached_embedding is not None:
-                similarity = self._calculate_similarity(query_embedding, cached_embedding)
-                if similarity > best_similarity and similarity >= self.cache_threshold:
-                    best_similarity = similarity
-                    best_response = cached_data['response']
+        try:
+            snapshot = self._snapshot_session(session_id, query_vec.shape[0])
+            if snapshot is None:
+                return None
+            matrix, keys = snapshot
+            best_indices, best_similarities = self._best_matches(matrix, query_vec[np.newaxis, :])
+        except Exception as e:
+            logger.warning(f"会话 {session_id} 缓存匹配失败: {e}")
+            return None
+        best_idx, best_similarity = int(best_indices[0]), float(best_similarities[0])
 
-        if best_response:
-            logger.info(f"🎯 会话缓存命中! Session: {session_id}, 相似度: {best_similarity:.3f}")
-            return best_response
+        if best_similarity >= self.cache_threshold:
+            response = self._read_matched_response(session_id, best_idx, keys[best_idx])
+            if response is not None:
+                logger.info(f"🎯 会话缓存命中! Session: {session_id}, 相似度: {best_similarity:.3f}")
+                return response
 
         return None
 
+    def check_semantic_cache_batch(self, requests: List[Tuple[str, str]], prechecked: bool = False) -> List[Optional[str]]:
+        """
+        批量检查会话级语义缓存
+
+        Args:
+            requests: [(query, session_id), ...]
+            prechecked: 调用方是否已对每个请求做过会话缓存存在性检查和精确匹配（如微批处理器），
+                为True时直接进入语义匹配
+
+        Returns:
+            与requests一一对应的缓存答案，未命中为None
+        """
+        results = [None] * len(requests)
+
+        # 只处理已有缓存的会话；精确匹配的请求直接返回，其余再做语义匹配
+        pending = []
+        for i, (query, session_id) in enumerate(requests):
+            if prechecked:
+                pending.append((i, query, session_id))
+                continue
+            if not self.has_semantic_cache(session_id):
+                continue
+            cached_response = self._lookup_exact(query, session_id)
+            if cached_response is not None:
+                results[i] = cached_response
+            else:
+                pending.append((i, query, session_id))
+        if not pending:
+            return results
+
+        try:
+            # 所有待查询合并为一次embedding计算
+            query_vecs = self._embed_batch([query for _, query, _ in pending])
+        except Exception as e:
+            logger.warning(f"批量查询向量计算失败: {e}")
+            return results
+
+        by_session = {}
+        for (i, _, session_id), query_vec in zip(pending, query_vecs):
+            by_session.setdefault(session_id, []).append((i, query_vec))
+
+        for session_id, items in by_session.items():
+            # 逐会话隔离异常，单个会话的缓存损坏不影响同批其他会话
+            try:
+                snapshot = self._snapshot_session(session_id, items[0][1].shape[0])
+                if snapshot is None:
+                    continue
+                matrix, keys = snapshot
+                best_indices, best_similarities = self._best_matches(
+                    matrix,
+                    np.stack([query_vec for _, query_vec in items])
+                )
+            except Exception as e:
+                logger.warning(f"会话 {session_id} 缓存匹配失败: {e}")
+                continue
+            # 先argmax再整体阈值比较，只遍历命中的查询
+            for k in np.flatnonzero(best_similarities >= self.cache_threshold):
+                best_idx = int(best_indices[k])
+                response = self._read_matched_response(session_id, best_idx, keys[best_idx])
+                if response is not None:
+                    logger.info(f"🎯 会话缓存命中! Session: {session_id}, 相似度: {float(best_similarities[k]):.3f}")
+                    results[items[k][0]] = response
+
+        return results
+
+    def _update_exact_slot(self, session_id: str, exact_key: str, response: str) -> Tuple[bool, Optional[Tuple]]:
+        """
+        已缓存的查询只更新答案和时间戳，调用方需持有_session_lock
+
+        Returns:
+            (是否已缓存, 待在锁外持久化的槽位数据)
+        """
+        session_cache = self._get_session_cache(session_id)
+        slot = session_cache['exact'].get(exact_key) if session_cache else None
+        if slot is None:
+            return False, None
+
+        session_cache['responses'][slot] = response
+        session_cache['timestamps'][slot] = time.time_ns()
+        return True, self._slot_record(session_id, session_cache, slot)
+
+    def _write_new_slot(self, session_id: str, exact_key: str, query: str, response: str,
+                        query_vec: np.ndarray) -> Tuple[Optional[Tuple], int]:
+        """
+        写入环形缓冲区的下一个槽位，缓存满时直接覆盖最旧的槽位；调用方需持有_session_lock
+
+        Returns:
+            (待在锁外持久化的槽位数据, 当前缓存大小)
+        """
+        # 初始化会话缓存；维度与当前模型不一致的旧缓存丢弃后重建
+        session_cache = self._get_session_cache(session_id)
+        if session_cache is None or not self._check_dimension(session_id, session_cache, query_vec.shape[0]):
+            session_cache = self._new_session_cache(session_id, query_vec.shape[0])
+            self.session_caches[session_id] = session_cache
+
+        head = session_cache['head']
+        evicted_query = session_cache['keys'][head]
+        if evicted_query is not None:
+            session_cache['exact'].pop(self._normalize_query(evicted_query), None)
+        session_cache['exact'][exact_key] = head
+        session_cache['matrix'][head] = query_vec
+        session_cache['keys'][head] = query
+        session_cache['responses'][head] = response
+        session_cache['timestamps'][head] = time.time_ns()
+        session_cache['head'] = (head + 1) % self.max_session_cache_size
+        session_cache['size'] = min(session_cache['size'] + 1, self.max_session_cache_size)
+        return self._slot_record(session_id, session_cache, head), session_cache['size']
+
     def add_to_semantic_cache(self, query: str, response: str, session_id: str = None):
         """将查询-答案对添加到会话级语义缓存"""
         try:
             if not session_id:
                 return
 
-            # 初始化会话缓存
-            if session_id not in self.session_caches:
-                self.session_caches[session_id] = {}
-                self.session_embeddings[session_id] = {}
+            exact_key = self._normalize_query(query)
 
-            session_cache = self.session_caches[session_id]
-            session_embeddings = self.session_embeddings[session_id]
+            # 已缓存的查询只更新答案，向量保持不变
+            with self._session_lock:
+                updated, record = self._update_exact_slot(session_id, exact_key, response)
+            if updated:
+                self._persist_slot(record)
+                return
 
-            # 限制会话缓存大小
-            if len(session_cache) >= self.max_session_cache_size:
-                # 删除最旧的缓存项
-                oldest_key = next(iter(session_cache))
-                del session_cache[oldest_key]
-                del session_embeddings[oldest_key]
+            # 计算查询向量（插入时已归一化），以float16存储减半内存占用；embedding在锁外计算
+            query_vec = self._embed(query).astype(np.float16)
 
-            # 计算查询向量
-            query_embedding = self.embedding_model.embed_documents([query])[0]
+            # 槽位写入需原子完成：并发写同一会话时，exact映射必须指向存有自身答案的槽位
+            with self._session_lock:
+                # 计算embedding期间其他线程可能已写入同一查询
+                updated, record = self._update_exact_slot(session_id, exact_key, response)
+                if not updated:
+                    record, cache_size = self._write_new_slot(session_id, exact_key, query, response, query_vec)
 
-            # 添加到缓存
-            session_cache[query] = {
-                'response': response,
-                'timestamp': datetime.now().isoformat()
-            }
-            session_embeddings[query] = query_embedding
+            # 磁盘写入在锁外进行，避免阻塞其他会话的缓存查询
+            self._persist_slot(record)
+            if updated:
+                return
 
-            logger.info(f"📝 已添加到会话缓存 {session_id}, 当前大小: {len(session_cache)}")
+            logger.info(f"📝 已添加到会话缓存 {session_id}, 当前大小: {cache_size}")
 
         except Exception as e:
             logger.warning(f"添加到语义缓存失败: {e}")
@@ -132,13 +567,21 @@ class SessionCacheManager:
             context.append({
                 'query': query,
                 'response': response,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': time.time_ns()  # 整数时间戳，仅用于排序/调试
             })
 
             # 限制上下文长度
             if len(context) > self.max_context_length:
                 context.pop(0)  # 删除最旧的对话
 
+            # 只格式化新的一轮，最近几轮的拼接结果在写入时更新，读取时直接复用
+            turns = self.session_context_turns.get(session_id)
+            if turns is None:
+                turns = deque(maxlen=self.max_prompt_context_turns)
+                self.session_context_turns[session_id] = turns
+            turns.append(f"用户问: {query}\nAI答: {response[:100]}...")  # 截取前100字符
+            self.session_context_prompts[session_id] = "\n".join(turns)
+
             logger.info(f"📝 已添加上下文到会话 {session_id}, 当前长度: {len(context)}")
 
         except Exception as e:
@@ -147,27 +590,12 @@ class SessionCacheManager:
     def get_context_for_query(self, session_id: str, current_query: str) -> str:
         """获取增强的查询上下文"""
         try:
-            if not session_id or session_id not in self.session_contexts:
-                return current_query
-
-            context = self.session_contexts[session_id]
-            if not context:
+            context_prompt = self.session_context_prompts.get(session_id) if session_id else None
+            if not context_prompt:
                 return current_query
 
-            # 构建上下文增强的查询
-            context_parts = []
-            
-            # 添加最近的对话历史（最多3轮）
-            recent_context = context[-3:] if len(context) > 3 else context
-            
-            for item in recent_context:
-                context_parts.append(f"用户问: {item['query']}")
-                context_parts.append(f"AI答: {item['response'][:100]}...")  # 截取前100字符
-            
-            # 添加当前查询
-            context_parts.append(f"当前问题: {current_query}")
-            
-            enhanced_query = "\n".join(context_parts)
+            # 最近的对话历史（最多3轮）+ 当前查询
+            enhanced_query = f"{context_prompt}\n当前问题: {current_query}"
             
             logger.info(f"🔗 已为会话 {session_id} 构建上下文增强查询")
             return enhanced_query
@@ -180,7 +608,7 @@ class SessionCacheManager:
         """获取缓存统计信息"""
         return {
             'total_sessions': len(self.session_caches),
-            'total_cached_queries': sum(len(cache) for cache in self.session_caches.values()),
+            'total_cached_queries': sum(cache['size'] for cache in self.session_caches.values()),
             'total_contexts': sum(len(context) for context in self.session_contexts.values()),
             'cache_threshold': self.cache_threshold,
             'max_session_cache_size': self.max_session_cache_size,
@@ -191,15 +619,21 @@ class SessionCacheManager:
         """清除指定会话的缓存"""
         if session_id in self.session_caches:
             del self.session_caches[session_id]
-        if session_id in self.session_embeddings:
-            del self.session_embeddings[session_id]
+        self._delete_persisted_session(session_id)
         if session_id in self.session_contexts:
             del self.session_contexts[session_id]
+        self.session_context_turns.pop(session_id, None)
+        self.session_context_prompts.pop(session_id, None)
         logger.info(f"🗑️ 已清除会话 {session_id} 的缓存")
 
     def clear_all_caches(self):
         """清除所有缓存"""
+        for session_id in set(self.session_caches) | self._persisted_sessions:
+            self._delete_persisted_session(session_id)
         self.session_caches.clear()
-        self.session_embeddings.clear()
         self.session_contexts.clear()
+        self.session_context_turns.clear()
+        self.session_context_prompts.clear()
+        with self._embedding_cache_lock:
+            self._embedding_cache.clear()
         logger.info("🗑️ 已清除所有会话缓存")
@@ -6,12 +6,77 @@ Web服务处理模块
 import logging
 import json
 import time
+import queue
+import threading
 import concurrent.futures
 from datetime import datetime
 from typing import Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+class SemanticCacheBatcher:
+    """
+    语义缓存微批处理器
+
+    并发请求的缓存检查在后台线程中按时间窗口合并：
+    一次embedding计算 + 每个会话一次矩阵乘法，代替逐个请求的向量计算
+    """
+
+    def __init__(self, cache_manager, max_batch_size: int = 16, max_wait: float = 0.01):
+        """初始化微批处理器"""
+        self.cache_manager = cache_manager
+        self.max_batch_size = max_batch_size  # 单批最大请求数
+        self.max_wait = max_wait  # 凑批的最长等待时间（秒）
+        self._queue = queue.Queue()
+
+        self._worker = threading.Thread(target=self._run, name="semantic-cache-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, query: str, session_id: str) -> concurrent.futures.Future:
+        """提交一次缓存检查，返回结果为缓存答案或None的Future"""
+        future = concurrent.futures.Future()
+
+        # 会话尚无缓存时无需排队
+        if not self.cache_manager.has_semantic_cache(session_id):
+            future.set_result(None)
+            return future
+
+        # 精确命中在调用线程内直接返回，不等待凑批窗口和同批未命中请求的embedding
+        cached_response = self.cache_manager.check_exact_cache(query, session_id)
+        if cached_response is not None:
+            future.set_result(cached_response)
+            return future
+
+        self._queue.put((query, session_id, future))
+        return future
+
+    def _run(self):
+        """后台线程：收集一个时间窗口内的请求并批量检查"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                # submit()已做过存在性检查和精确匹配，这里只做语义匹配
+                results = self.cache_manager.check_semantic_cache_batch(
+                    [(query, session_id) for query, session_id, _ in batch],
+                    prechecked=True
+                )
+            except Exception as e:
+                logger.warning(f"批量缓存检查失败: {e}")
+                results = [None] * len(batch)
+
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+
 class WebServiceHandler:
     """
     Web服务处理器
@@ -27,6 +92,10 @@ class WebServiceHandler:
         """初始化Web服务处理器"""
         self.rag_system = rag_system
         self.app = None
+        self.cache_batcher = None
+
+        # 请求内并行子任务共用的线程池，避免每个请求新建/销毁线程
+        self.request_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
     
     def setup_flask_app(self):
         """设置Flask应用和路由"""
@@ -36,6 +105,9 @@ class WebServiceHandler:
             
             self.app = Flask(__name__)
             CORS(self.app)
+
+            # 并发请求的语义缓存检查合并为批处理
+            self.cache_batcher = SemanticCacheBatcher(self.rag_system.cache_manager)
             
             # 设置路由
             self._setup_routes()
@@ -131,36 +203,33 @@ class WebServiceHandler:
             cached_response = None
             enhanced_query = query
             
-            def check_cache():
-                nonlocal cached_response
-                cached_response = self.rag_system.cache_manager.check_semantic_cache(query, session_id)
-            
             def prepare_query():
                 nonlocal enhanced_query
                 enhanced_query = self.rag_system.cache_manager.get_context_for_query(session_id, query)
             
-            # 并行执行缓存检查和查询预处理
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                future_cache = executor.submit(check_cache)
-                future_query = executor.submit(prepare_query)
-                
-                # 等待缓存检查完成
-                concurrent.futures.wait([future_cache], timeout=1)
-                
-                if cached_response:
-                    # 缓存命中，取消查询预处理
-                    future_query.cancel()
-                    self.rag_system.cache_manager.add_to_context(session_id, query, cached_response)
-                    return jsonify({
-                        "response": cached_response,
-                        "query": query,
-                        "session_id": session_id,
-                        "timestamp": str(datetime.now()),
-                        "from_cache": True
-                    })
-                
-                # 缓存未命中，等待查询预处理完成
-                concurrent.futures.wait([future_query], timeout=2)
+            # 并行执行缓存检查（由微批处理器合并计算）和查询预处理
+            future_cache = self.cache_batcher.submit(query, session_id)
+            future_query = self.request_executor.submit(prepare_query)
+            
+            # 等待缓存检查完成
+            concurrent.futures.wait([future_cache], timeout=1)
+            if future_cache.done():
+                cached_response = future_cache.result()
+            
+            if cached_response:
+                # 缓存命中，取消查询预处理
+                future_query.cancel()
+                self.rag_system.cache_manager.add_to_context(session_id, query, cached_response)
+                return jsonify({
+                    "response": cached_response,
+                    "query": query,
+                    "session_id": session_id,
+                    "timestamp": str(datetime.now()),
+                    "from_cache": True
+                })
+            
+            # 缓存未命中，等待查询预处理完成
+            concurrent.futures.wait([future_query], timeout=2)
             
             # 缓存未命中，执行完整的RAG流程
             documents, analysis = self.rag_system.query_router.route_query(
@@ -168,7 +237,11 @@ class WebServiceHandler:
                 top_k=self.rag_system.config.top_k
             )
             # 使用生成模块生成最终答案
-            response = self.rag_system.generation_module.generate_adaptive_answer(enhanced_query, documents)
+            generation_module = self.rag_system.generation_module
+            response = generation_module.generate_adaptive_answer(
+                enhanced_query, documents,
+                model_name=generation_module.select_model(analysis.query_complexity)
+            )
             
             # 将结果添加到会话缓存和上下文
             self.rag_system.cache_manager.add_to_semantic_cache(query, response, session_id)
@@ -202,37 +275,34 @@ class WebServiceHandler:
                     cached_response = None
                     enhanced_query = query
                     
-                    def check_cache():
-                        nonlocal cached_response
-                        cached_response = self.rag_system.cache_manager.check_semantic_cache(query, session_id)
-                    
                     def prepare_query():
                         nonlocal enhanced_query
                         enhanced_query = self.rag_system.cache_manager.get_context_for_query(session_id, query)
                     
-                    # 并行执行缓存检查和查询预处理
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                        future_cache = executor.submit(check_cache)
-                        future_query = executor.submit(prepare_query)
-                        
-                        # 等待缓存检查完成
-                        concurrent.futures.wait([future_cache], timeout=1)
-                        
-                        if cached_response:
-                            # 缓存命中，快速返回
-                            future_query.cancel()
-                            self.rag_system.cache_manager.add_to_context(session_id, query, cached_response)
-                            chunk_size = 3
-                            for i in range(0, len(cached_response), chunk_size):
-                                chunk = cached_response[i:i+chunk_size]
-                                data_obj = {"chunk": chunk, "from_cache": True}
-                                yield f"data: {json.dumps(data_obj)}\n\n"
-                                time.sleep(0.02)  # 更快的流式响应
-                            yield f"data: [DONE]\n\n"
-                            return
-                        
-                        # 缓存未命中，等待查询预处理完成
-                        concurrent.futures.wait([future_query], timeout=2)
+                    # 并行执行缓存检查（由微批处理器合并计算）和查询预处理
+                    future_cache = self.cache_batcher.submit(query, session_id)
+                    future_query = self.request_executor.submit(prepare_query)
+                    
+                    # 等待缓存检查完成
+                    concurrent.futures.wait([future_cache], timeout=1)
+                    if future_cache.done():
+                        cached_response = future_cache.result()
+                    
+                    if cached_response:
+                        # 缓存命中，快速返回
+                        future_query.cancel()
+                        self.rag_system.cache_manager.add_to_context(session_id, query, cached_response)
+                        chunk_size = 3
+                        for i in range(0, len(cached_response), chunk_size):
+                            chunk = cached_response[i:i+chunk_size]
+                            data_obj = {"chunk": chunk, "from_cache": True}
+                            yield f"data: {json.dumps(data_obj)}\n\n"
+                            time.sleep(0.02)  # 更快的流式响应
+                        yield f"data: [DONE]\n\n"
+                        return
+                    
+                    # 缓存未命中，等待查询预处理完成
+                    concurrent.futures.wait([future_query], timeout=2)
                     
                     # 缓存未命中，执行完整的RAG流程
                     documents, analysis = self.rag_system.query_router.route_query(
@@ -241,8 +311,10 @@ class WebServiceHandler:
                     )
                     
                     # 流式生成答案
+                    generation_module = self.rag_system.generation_module
+                    model_name = generation_module.select_model(analysis.query_complexity)
                     full_response = ""
-                    for chunk in self.rag_system.generation_module.generate_adaptive_answer_stream(enhanced_query, documents):
+                    for chunk in generation_module.generate_adaptive_answer_stream(enhanced_query, documents, model_name=model_name):
                         full_response += chunk
                         data_obj = {"chunk": chunk}
                         yield f"data: {json.dumps(data_obj)}\n\n"